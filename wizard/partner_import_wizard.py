@@ -2,22 +2,39 @@ from odoo import models, fields, api, _
 import base64
 import csv
 import io
+import functools
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import email_normalize
 import logging
 
-# For Excel support
-try:
-    import openpyxl
-    EXCEL_SUPPORT = True
-except ImportError:
-    EXCEL_SUPPORT = False
-    logging.warning("openpyxl library not found. Excel import will be disabled.")
+# Columns read from the import file, in the order rows are passed to
+# _process_rows; everything else is ignored
+IMPORT_COLUMNS = ('name', 'email', 'phone', 'street', 'city', 'zip', 'country')
+REQUIRED_COLUMNS = {'name', 'email'}
+
+@functools.lru_cache(maxsize=64)
+def _header_indexes(header_row):
+    """Normalize a raw header row and locate IMPORT_COLUMNS in it.
+
+    Cached so repeated imports of files with the same layout skip the work.
+    """
+    headers = [str(h).strip().lower() if h else '' for h in header_row]
+    return tuple(
+        headers.index(h) if h in headers else -1
+        for h in IMPORT_COLUMNS
+    )
+
+# Number of partners created or updated per transaction
+IMPORT_BATCH_SIZE = 1000
 
 class PartnerImportWizard(models.TransientModel):
     _name = 'partner.import.wizard'
     _description = 'Partner Import Wizard'
 
-    file = fields.Binary(string='Upload File', required=True)
+    # openpyxl module, imported on the first Excel import (see _get_openpyxl)
+    _openpyxl = None
+
+    file = fields.Binary(string='Upload File', required=True, attachment=True)
     file_name = fields.Char(string='File Name')
     import_mode = fields.Selection([
         ('create', 'Create New Records'),
@@ -27,25 +44,37 @@ class PartnerImportWizard(models.TransientModel):
     file_type = fields.Selection([
         ('csv', 'CSV'),
         ('xlsx', 'Excel (XLSX)'),
-    ], string='File Type', compute='_compute_file_type', store=True)
+    ], string='File Type', compute='_compute_file_type')
+
+    @staticmethod
+    def _detect_file_type(name):
+        """Return 'xlsx', 'csv' or False from the file name extension"""
+        ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        if ext in ('xlsx', 'csv'):
+            return ext
+        return False
+
+    @staticmethod
+    def _detect_content_type(head):
+        """Return 'xlsx', 'csv' or False from the first bytes of the file"""
+        if head.startswith(b'PK\x03\x04'):  # XLSX files are ZIP archives
+            return 'xlsx'
+        if b'\x00' in head:
+            return False
+        return 'csv'
 
     @api.depends('file_name')
     def _compute_file_type(self):
         for record in self:
             if record.file_name:
-                if record.file_name.lower().endswith('.xlsx'):
-                    record.file_type = 'xlsx'
-                elif record.file_name.lower().endswith('.csv'):
-                    record.file_type = 'csv'
-                else:
-                    record.file_type = False
+                record.file_type = self._detect_file_type(record.file_name)
             else:
                 record.file_type = 'csv'
 
     @api.constrains('file_name')
     def _check_file_type(self):
         for record in self:
-            if record.file_name and not record.file_type:
+            if record.file_name and not self._detect_file_type(record.file_name):
                 raise ValidationError(_(
                     "Unsupported file format. Please upload a CSV or Excel (XLSX) file."
                 ))
@@ -60,28 +89,42 @@ class PartnerImportWizard(models.TransientModel):
             raise UserError(_(
                 "Unsupported file format '%s'. Please upload a CSV or Excel (XLSX) file."
             ) % self.file_name.split('.')[-1])
-            
-        if self.file_type == 'xlsx' and not EXCEL_SUPPORT:
-            raise UserError(_(
-                "Excel import requires the openpyxl library. "
-                "Please install it with: pip install openpyxl"
-            ))
-        
+
         try:
-            file_content = base64.b64decode(self.file)
-            
-            if self.file_type == 'csv':
+            file_content = self._get_file_content()
+
+            # Dispatch on the actual content so renamed files fail early
+            file_type = self._detect_content_type(file_content[:512])
+            if not file_type:
+                raise UserError(_(
+                    "The content of '%s' is neither a CSV nor an Excel (XLSX) file."
+                ) % self.file_name)
+
+            if file_type == 'csv':
                 result = self._process_csv(file_content)
             else:
                 result = self._process_excel(file_content)
                 
             return result
                 
+        except UserError:
+            raise
         except Exception as e:
             error_msg = _("Failed to process file: %s") % str(e)
             logging.error(error_msg, exc_info=True)
             raise UserError(error_msg)
 
+    def _get_file_content(self):
+        """Return the uploaded file as bytes, read from the attachment store when possible"""
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('res_field', '=', 'file'),
+        ], limit=1)
+        if attachment:
+            return attachment.raw
+        return base64.b64decode(self.file)
+
     def _process_csv(self, file_content):
         """Process CSV file content"""
         try:
@@ -103,9 +146,16 @@ class PartnerImportWizard(models.TransientModel):
                     ))
             
             file_io = io.StringIO(file_string)
-            reader = csv.DictReader(file_io)
-            return self._process_rows(reader)
+            reader = csv.reader(file_io)
+            indexes = self._get_column_indexes(next(reader, []))
+            rows = (
+                tuple(r[i] if -1 < i < len(r) else None for i in indexes)
+                for r in reader
+            )
+            return self._process_rows(rows)
             
+        except UserError:
+            raise
         except csv.Error as e:
             raise UserError(_(
                 "Invalid CSV file format. Please check the file structure. Error: %s"
@@ -113,76 +163,197 @@ class PartnerImportWizard(models.TransientModel):
         except Exception as e:
             raise UserError(_("Failed to process CSV file: %s") % str(e))
 
+    def _get_column_indexes(self, header_row):
+        """Return the position of each IMPORT_COLUMNS entry in header_row, -1 if absent
+
+        Raises a UserError right away when a required column is missing, so a
+        wrong file is rejected before any row is read.
+        """
+        indexes = _header_indexes(tuple(header_row))
+        missing = [
+            column for column, index in zip(IMPORT_COLUMNS, indexes)
+            if index == -1 and column in REQUIRED_COLUMNS
+        ]
+        if missing:
+            raise UserError(_("Missing columns: %s") % ', '.join(missing))
+        return indexes
+
+    @classmethod
+    def _get_openpyxl(cls):
+        """Import openpyxl on first use and cache it on the class"""
+        if cls._openpyxl is None:
+            try:
+                import openpyxl
+            except ImportError:
+                logging.warning("openpyxl library not found. Excel import is disabled.")
+                raise UserError(_(
+                    "Excel import requires the openpyxl library. "
+                    "Please install it with: pip install openpyxl"
+                ))
+            cls._openpyxl = openpyxl
+        return cls._openpyxl
+
     def _process_excel(self, file_content):
         """Process Excel file content"""
+        workbook = None
         try:
             excel_file = io.BytesIO(file_content)
-            workbook = openpyxl.load_workbook(excel_file, read_only=True)
+            workbook = self._get_openpyxl().load_workbook(excel_file, read_only=True)
             sheet = workbook.active
             
-            headers = []
-            for cell in sheet[1]:
-                headers.append(str(cell.value).lower() if cell.value else '')
+            # Single pass over the sheet: the first row is the header
+            sheet_rows = sheet.iter_rows(values_only=True)
+            header_row = next(sheet_rows, ())
+            indexes = self._get_column_indexes(header_row)
             
-            rows = []
-            for row in sheet.iter_rows(min_row=2):
-                row_data = {}
-                for idx, cell in enumerate(row):
-                    if idx < len(headers) and headers[idx]:
-                        row_data[headers[idx]] = cell.value
-                if any(val for val in row_data.values() if val not in (None, "")):
-                    rows.append(row_data)
+            # Empty rows are skipped by _process_rows, which also keeps
+            # the reported row numbers aligned with the sheet
+            rows = (
+                tuple(row[i] if -1 < i < len(row) else None for i in indexes)
+                for row in sheet_rows
+            )
             
             return self._process_rows(rows)
             
+        except UserError:
+            raise
         except Exception as e:
             raise UserError(_(
                 "Invalid Excel file. Please ensure it's a valid XLSX file. Error: %s"
             ) % str(e))
+        finally:
+            if workbook is not None:
+                workbook.close()
 
     def _process_rows(self, rows):
-        """Common processing for both CSV and Excel rows"""
+        """Common processing for both CSV and Excel rows
+
+        Each row is a tuple of values ordered as IMPORT_COLUMNS.
+        """
+        # Skip chatter tracking and follower subscription for bulk operations
+        Partner = self.env['res.partner'].with_context(
+            tracking_disable=True,
+            mail_create_nolog=True,
+            mail_create_nosubscribe=True,
+            mail_notrack=True,
+        )
         created = 0
         updated = 0
         errors = []
-        
+
+        # First pass: validate rows and build partner values
+        rows_parsed = []
+        emails = set()
+        seen_emails = set()
+        countries = set()
         for idx, row in enumerate(rows, start=2):  # Row numbers start at 2 (1 is header)
             try:
-                if not any(val for val in row.values() if val not in (None, "")):
+                if not any(val for val in row if val not in (None, "")):
                     continue
-                    
-                if not row.get('name') or not row.get('email'):
-                    errors.append(_(
-                        "Row %d: Missing required field - Name: %s, Email: %s"
-                    ) % (idx, row.get('name', ''), row.get('email', '')))
+
+                name, email, phone, street, city, zip_code, country = row
+                if not name or not email:
+                    errors.append((idx, 'missing_field', (name or '', email or '')))
                     continue
-                
+
+                # Key with the same normalization as res.partner.email_normalized,
+                # the partner keeps the email as written in the file
+                email = str(email).strip()
+                email_key = email_normalize(email) or email.lower()
+                if email_key in seen_emails:
+                    errors.append((idx, 'duplicate', email))
+                    continue
+                seen_emails.add(email_key)
+
                 partner_vals = {
-                    'name': row['name'],
-                    'email': row['email'],
-                    'phone': row.get('phone'),
-                    'street': row.get('street'),
-                    'city': row.get('city'),
-                    'zip': row.get('zip'),
-                    'country_id': self._get_country(row.get('country')),
+                    'name': name,
+                    'email': email,
+                    'phone': phone,
+                    'street': street,
+                    'city': city,
+                    'zip': zip_code,
                 }
-                
-                partner = self.env['res.partner'].search([('email', '=', row['email'])], limit=1)
-                
-                if partner and self.import_mode in ('update', 'both'):
-                    partner.write(partner_vals)
-                    updated += 1
-                elif not partner and self.import_mode in ('create', 'both'):
-                    self.env['res.partner'].create(partner_vals)
-                    created += 1
+                rows_parsed.append((idx, email_key, partner_vals, country))
+                emails.add(email_key)
+                if country:
+                    countries.add(country)
+
+            except Exception as e:
+                errors.append((idx, 'error', str(e)))
+
+        # Fetch all matching partners in one query instead of one search per
+        # row; email_normalized makes the match case-insensitive
+        existing = {}
+        if emails:
+            for rec in Partner.search_read(
+                    [('email_normalized', 'in', list(emails))], ['id', 'email_normalized']):
+                existing.setdefault(rec['email_normalized'], rec['id'])
+
+        # Resolve all distinct countries at once
+        country_cache = self._get_country_cache(countries)
+
+        # Second pass: split into records to create and records to update
+        to_create = []
+        to_update = []
+        for idx, email_key, partner_vals, country_name in rows_parsed:
+            try:
+                partner_vals['country_id'] = self._get_country(country_name, country_cache)
+                pid = existing.get(email_key)
+
+                # Only instantiate a recordset for partners we actually write
+                if pid and self.import_mode in ('update', 'both'):
+                    # The partner matched on this address, keep its stored email
+                    update_vals = dict(partner_vals)
+                    del update_vals['email']
+                    to_update.append((idx, Partner.browse(pid), update_vals))
+                elif not pid and self.import_mode in ('create', 'both'):
+                    to_create.append((idx, partner_vals))
                 else:
-                    errors.append(_(
-                        "Row %d: Skipped - %s (Import mode doesn't allow this operation)"
-                    ) % (idx, row['email']))
-            
+                    errors.append((idx, 'skipped', partner_vals['email']))
+
             except Exception as e:
-                errors.append(_("Row %d: Error processing - %s") % (idx, str(e)))
-        
+                errors.append((idx, 'error', str(e)))
+
+        # Create new partners in batches, committing after each one to keep
+        # transactions and locks short on large imports
+        for start in range(0, len(to_create), IMPORT_BATCH_SIZE):
+            batch = to_create[start:start + IMPORT_BATCH_SIZE]
+            try:
+                with self.env.cr.savepoint():
+                    Partner.create([partner_vals for idx, partner_vals in batch])
+                created += len(batch)
+            except Exception:
+                # Retry the batch row by row so failures map to row numbers
+                for idx, partner_vals in batch:
+                    try:
+                        with self.env.cr.savepoint():
+                            Partner.create(partner_vals)
+                        created += 1
+                    except Exception as e:
+                        errors.append((idx, 'error', str(e)))
+            self.env.cr.commit()
+
+        for start in range(0, len(to_update), IMPORT_BATCH_SIZE):
+            batch = to_update[start:start + IMPORT_BATCH_SIZE]
+            try:
+                with self.env.cr.savepoint():
+                    for idx, partner, partner_vals in batch:
+                        partner.write(partner_vals)
+                updated += len(batch)
+            except Exception:
+                # Retry the batch row by row so failures map to row numbers
+                for idx, partner, partner_vals in batch:
+                    try:
+                        with self.env.cr.savepoint():
+                            partner.write(partner_vals)
+                        updated += 1
+                    except Exception as e:
+                        errors.append((idx, 'error', str(e)))
+            self.env.cr.commit()
+
+        # Errors are collected over several passes, report them in row order
+        errors.sort(key=lambda error: error[0])
+
         # Prepare notification based on results
         base_message = _(
             "Import completed: %(created)d created, %(updated)d updated",
@@ -192,7 +363,8 @@ class PartnerImportWizard(models.TransientModel):
         
         if errors:
             error_count = len(errors)
-            error_samples = "\n".join(errors[:3])  # Show first 3 errors as samples
+            # Only translate and format the first 3 errors shown as samples
+            error_samples = "\n".join(self._format_error(*error) for error in errors[:3])
             if error_count > 3:
                 error_samples += _("\n...and %d more errors") % (error_count - 3)
             
@@ -229,13 +401,58 @@ class PartnerImportWizard(models.TransientModel):
         # Also log full results for admin review
         log_message = f"Partner Import Results:\n{base_message}\n"
         if errors:
-            log_message += f"Errors:\n" + "\n".join(errors)
+            log_message += "Errors:\n" + "\n".join(
+                self._format_error_log(*error) for error in errors
+            )
         logging.info(log_message)
         
         return notification
 
-    def _get_country(self, country_name):
+    def _format_error(self, idx, reason, detail):
+        """Build the user-facing message for an error tuple from _process_rows"""
+        if reason == 'missing_field':
+            return _(
+                "Row %d: Missing required field - Name: %s, Email: %s"
+            ) % ((idx,) + tuple(detail))
+        if reason == 'duplicate':
+            return _("Row %d: Skipped - %s (Duplicate email in file)") % (idx, detail)
+        if reason == 'skipped':
+            return _(
+                "Row %d: Skipped - %s (Import mode doesn't allow this operation)"
+            ) % (idx, detail)
+        return _("Row %d: Error processing - %s") % (idx, detail)
+
+    def _format_error_log(self, idx, reason, detail):
+        """Build the untranslated log line for an error tuple from _process_rows"""
+        if reason == 'missing_field':
+            return "Row %d: Missing required field - Name: %s, Email: %s" % ((idx,) + tuple(detail))
+        if reason == 'duplicate':
+            return "Row %d: Skipped - %s (Duplicate email in file)" % (idx, detail)
+        if reason == 'skipped':
+            return "Row %d: Skipped - %s (Import mode doesn't allow this operation)" % (idx, detail)
+        return "Row %d: Error processing - %s" % (idx, detail)
+
+    def _get_country_cache(self, country_names):
+        """Map lowercased country codes and names to ids using a single query
+
+        Every translation of the country name is indexed, so files using
+        ISO codes or names in another language are resolved as well.
+        """
+        if not country_names:
+            return {}
+        self.env['res.country'].flush_model(['code', 'name'])
+        self.env.cr.execute("SELECT id, code, name FROM res_country")
+        cache = {}
+        for country_id, code, name in self.env.cr.fetchall():
+            if code:
+                cache[code.lower()] = country_id
+            # name is a jsonb of translations on recent versions
+            for value in (name.values() if isinstance(name, dict) else [name]):
+                if value:
+                    cache.setdefault(value.strip().lower(), country_id)
+        return cache
+
+    def _get_country(self, country_name, cache):
         if not country_name:
             return False
-        country = self.env['res.country'].search([('name', '=', country_name)], limit=1)
-        return country.id if country else False
\ No newline at end of file
+        return cache.get(str(country_name).strip().lower(), False)
\ No newline at end of file